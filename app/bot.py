@@ -1,16 +1,18 @@
 import os
+import asyncio
 import logging
+from datetime import datetime
 from aiogram import Bot, Dispatcher, types
 from aiogram.contrib.fsm_storage.memory import MemoryStorage
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters import Command
 from aiogram.types import ParseMode
+from sqlalchemy import text
 from dotenv import load_dotenv
 
-from app.database import get_db
+from app.database import async_engine
+from app.models import REFRESH_SNAPSHOT_DAILY
 from app.services.nlp_service import NLPService, QueryBuilder
-from sqlalchemy.orm import Session
-from sqlalchemy import text
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -26,7 +28,11 @@ dp = Dispatcher(bot, storage=storage)
 
 # Initialize NLP service
 try:
-    nlp_service = NLPService(openai_api_key=os.getenv('OPENAI_API_KEY'))
+    nlp_service = NLPService(
+        openai_api_key=os.getenv('OPENAI_API_KEY'),
+        cache_path=os.getenv('NLP_CACHE_PATH'),
+        semantic_cache=os.getenv('NLP_SEMANTIC_CACHE', '').lower() in ('1', 'true', 'yes')
+    )
 except Exception as e:
     logger.error(f"Failed to initialize NLP service: {e}")
     raise
@@ -67,15 +73,29 @@ async def send_help(message: types.Message):
     )
     await message.reply(help_text, parse_mode=ParseMode.MARKDOWN)
 
+async def keep_typing(delay: float = 0.3, interval: float = 4):
+    """Send the typing action until cancelled; Telegram shows it for about 5 seconds.
+
+    The first action is only sent after ``delay``, so answers that are ready
+    sooner (templated questions, cached intents) skip the Telegram round-trip.
+    """
+    await asyncio.sleep(delay)
+    while True:
+        try:
+            await types.ChatActions.typing()
+        except Exception as e:
+            # The indicator is cosmetic; never let it fail the task unobserved
+            logger.warning(f"Failed to send typing action: {e}")
+        await asyncio.sleep(interval)
+
 @dp.message_handler()
 async def handle_message(message: types.Message):
     """Handle all other messages with the NLP service."""
+    # Show typing indicator if the question takes a while, without waiting for it
+    typing_task = asyncio.create_task(keep_typing())
     try:
-        # Show typing indicator
-        await types.ChatActions.typing()
-        
         # Parse the user's question
-        intent = nlp_service.parse_query(message.text)
+        intent = await nlp_service.parse_query(message.text)
         logger.info(f"Parsed intent: {intent}")
         
         # Build and execute the query
@@ -83,9 +103,9 @@ async def handle_message(message: types.Message):
         logger.info(f"Generated query: {query}")
         logger.info(f"Query params: {params}")
         
-        # Execute the query
-        db: Session = next(get_db())
-        result = db.execute(text(query), params).scalar()
+        # Execute the query; a read-only scalar doesn't need an ORM session
+        async with async_engine.connect() as conn:
+            result = (await conn.execute(QueryBuilder.compile(query), params)).scalar()
         
         # Format the response
         response = f"📊 Результат: {result}"
@@ -93,13 +113,39 @@ async def handle_message(message: types.Message):
     except Exception as e:
         logger.error(f"Error processing message: {e}", exc_info=True)
         response = "❌ Произошла ошибка при обработке вашего запроса. Пожалуйста, попробуйте сформулировать его иначе."
+    finally:
+        typing_task.cancel()
     
     await message.reply(response)
 
+async def refresh_snapshot_daily(interval: float = 3600):
+    """Refresh the snapshot_daily materialized view now and then periodically."""
+    while True:
+        try:
+            # Rows inserted before the refresh starts are in the view
+            started_at = datetime.utcnow()
+            async with async_engine.begin() as conn:
+                await conn.execute(text(REFRESH_SNAPSHOT_DAILY))
+            QueryBuilder.daily_view_refreshed_at = started_at
+            logger.info("Refreshed snapshot_daily")
+        except Exception as e:
+            logger.error(f"Failed to refresh snapshot_daily: {e}", exc_info=True)
+        await asyncio.sleep(interval)
+
+async def on_startup(dispatcher: Dispatcher):
+    """Start background maintenance tasks."""
+    dispatcher['refresh_task'] = asyncio.create_task(refresh_snapshot_daily())
+
+async def on_shutdown(dispatcher: Dispatcher):
+    """Release the OpenAI HTTP client and the database pool."""
+    dispatcher['refresh_task'].cancel()
+    await nlp_service.close()
+    await async_engine.dispose()
+
 def start_bot():
     """Start the bot."""
     from aiogram import executor
     
     # Start the bot
     logger.info("Starting bot...")
-    executor.start_polling(dp, skip_updates=True)
+    executor.start_polling(dp, skip_updates=True, on_startup=on_startup, on_shutdown=on_shutdown)
@@ -1,5 +1,6 @@
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
@@ -8,21 +9,37 @@ load_dotenv()
 
 # Database connection URL
 DATABASE_URL = f"postgresql://{os.getenv('POSTGRES_USER')}:{os.getenv('POSTGRES_PASSWORD')}@{os.getenv('POSTGRES_HOST')}:{os.getenv('POSTGRES_PORT')}/{os.getenv('POSTGRES_DB')}"
+ASYNC_DATABASE_URL = DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://", 1)
 
-# Create SQLAlchemy engine
+# Create SQLAlchemy engine (used by init_db and the data loading scripts)
 engine = create_engine(DATABASE_URL)
 
 # Session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-# Dependency to get DB session
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+# Async engine for the bot: queries must not block the event loop.
+# The async engine defaults to AsyncAdaptedQueuePool, which is what asyncpg needs.
+# QueryBuilder only produces a handful of SQL strings, so they all stay in the
+# per-connection prepared statement caches and the server reuses a generic plan
+# instead of re-planning on every execution (plan_cache_mode needs PostgreSQL 12+).
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    pool_size=20,
+    max_overflow=10,
+    pool_pre_ping=True,
+    connect_args={
+        "statement_cache_size": 200,
+        "prepared_statement_cache_size": 200,
+        "server_settings": {"plan_cache_mode": "force_generic_plan"}
+    }
+)
+
+# Async session factory
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False)
 
 def init_db():
     from . import models
     models.Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        for statement in models.STATS_DDL + models.SNAPSHOT_DAILY_DDL:
+            conn.execute(text(statement))
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, BigInteger, DateTime, ForeignKey, func
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, ForeignKey, Index, func, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -22,6 +22,23 @@ class Video(Base):
 
 class VideoSnapshot(Base):
     __tablename__ = 'video_snapshots'
+    __table_args__ = (
+        # Covers per-day counts and delta sums as index-only scans
+        Index(
+            'ix_snap_created_video',
+            'created_at', 'video_id',
+            postgresql_include=[
+                'delta_views_count', 'delta_likes_count',
+                'delta_comments_count', 'delta_reports_count'
+            ]
+        ),
+        # "Which videos got new views on day X"
+        Index(
+            'ix_snap_created_video_new_views',
+            'created_at', 'video_id',
+            postgresql_where=text('delta_views_count > 0')
+        ),
+    )
     
     id = Column(BigInteger, primary_key=True)
     video_id = Column(BigInteger, ForeignKey('videos.id'), nullable=False, index=True)
@@ -33,7 +50,78 @@ class VideoSnapshot(Base):
     delta_likes_count = Column(Integer, default=0)
     delta_comments_count = Column(Integer, default=0)
     delta_reports_count = Column(Integer, default=0)
-    created_at = Column(DateTime, nullable=False, index=True)
+    created_at = Column(DateTime, nullable=False)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     video = relationship("Video", back_populates="snapshots")
+
+class Stat(Base):
+    """Precomputed counters, kept up to date by triggers (see STATS_DDL)."""
+    __tablename__ = 'stats'
+    
+    name = Column(String, primary_key=True)
+    value = Column(BigInteger, nullable=False, default=0)
+
+# Statement-level triggers keep stats.videos_total in sync with the videos table,
+# so "how many videos are there" is a primary key lookup instead of COUNT(*).
+# Transition tables make a bulk COPY update the counter once, not per row.
+STATS_DDL = [
+    """
+    CREATE OR REPLACE FUNCTION stats_videos_total() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            UPDATE stats SET value = value + (SELECT COUNT(*) FROM new_rows) WHERE name = 'videos_total';
+        ELSIF TG_OP = 'DELETE' THEN
+            UPDATE stats SET value = value - (SELECT COUNT(*) FROM old_rows) WHERE name = 'videos_total';
+        ELSE
+            UPDATE stats SET value = 0 WHERE name = 'videos_total';
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS stats_videos_insert ON videos",
+    """
+    CREATE TRIGGER stats_videos_insert AFTER INSERT ON videos
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION stats_videos_total()
+    """,
+    "DROP TRIGGER IF EXISTS stats_videos_delete ON videos",
+    """
+    CREATE TRIGGER stats_videos_delete AFTER DELETE ON videos
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION stats_videos_total()
+    """,
+    "DROP TRIGGER IF EXISTS stats_videos_truncate ON videos",
+    """
+    CREATE TRIGGER stats_videos_truncate AFTER TRUNCATE ON videos
+    FOR EACH STATEMENT EXECUTE FUNCTION stats_videos_total()
+    """,
+    # (Re)seed the counter from the table itself
+    """
+    INSERT INTO stats (name, value) SELECT 'videos_total', COUNT(*) FROM videos
+    ON CONFLICT (name) DO UPDATE SET value = EXCLUDED.value
+    """
+]
+
+# Per-day, per-video sums of the snapshot deltas. Sums over whole days read
+# this view instead of scanning every hourly snapshot; it is refreshed after
+# each data load and periodically by the bot (REFRESH_SNAPSHOT_DAILY).
+SNAPSHOT_DAILY_DDL = [
+    """
+    CREATE MATERIALIZED VIEW IF NOT EXISTS snapshot_daily AS
+    SELECT
+        date_trunc('day', created_at) AS day,
+        video_id,
+        SUM(delta_views_count) AS delta_views_count,
+        SUM(delta_likes_count) AS delta_likes_count,
+        SUM(delta_comments_count) AS delta_comments_count,
+        SUM(delta_reports_count) AS delta_reports_count
+    FROM video_snapshots
+    GROUP BY 1, 2
+    """,
+    # Unique index is required for REFRESH ... CONCURRENTLY
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_snapshot_daily_day_video ON snapshot_daily (day, video_id)"
+]
+
+REFRESH_SNAPSHOT_DAILY = "REFRESH MATERIALIZED VIEW CONCURRENTLY snapshot_daily"
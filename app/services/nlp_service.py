@@ -1,98 +1,422 @@
-from typing import Dict, Any, Optional
-from datetime import datetime
-from langchain.chat_models import ChatOpenAI
-from langchain.prompts import ChatPromptTemplate
-from langchain.chains import LLMChain
-from langchain.output_parsers import PydanticOutputParser
+from typing import Dict, Any, Optional, List, Tuple
+from collections import OrderedDict
+from functools import lru_cache
+from datetime import datetime, timezone
+import asyncio
+import logging
+import os
+import pickle
+import shelve
+import threading
+import time
+from sqlalchemy import text
+from sqlalchemy.sql.elements import TextClause
+import httpx
+import numpy as np
+from openai import AsyncOpenAI
 from pydantic import BaseModel, Field
 import re
 
+logger = logging.getLogger(__name__)
+
 class QueryIntent(BaseModel):
     """Represents the intent extracted from a natural language query."""
     intent: str = Field(..., description="The type of query (count, sum, average, etc.)")
     metric: str = Field(..., description="The metric being queried (views, likes, comments, reports)")
-    time_range: Optional[Dict[str, str]] = Field(None, description="Time range for the query")
+    time_range: Optional[Dict[str, str]] = Field(None, description="Time range for the query, with 'start' and/or 'end' ISO 8601 datetimes")
     filters: Dict[str, Any] = Field(default_factory=dict, description="Additional filters for the query")
     group_by: Optional[str] = Field(None, description="Field to group results by")
 
+@lru_cache(maxsize=1)
+def _today_cached(bucket: int) -> str:
+    return datetime.now().strftime("%Y-%m-%d")
+
+def today() -> str:
+    """Current date as YYYY-MM-DD, formatted at most once a minute."""
+    return _today_cached(int(time.time() // 60))
+
+class FastIntentParser:
+    """Parses the templated questions from /start and /help without calling the LLM.
+
+    Only questions that match a template exactly are handled; anything else
+    returns None and goes to the LLM.
+    """
+    
+    MONTHS = {
+        'января': 1, 'февраля': 2, 'марта': 3, 'апреля': 4, 'мая': 5, 'июня': 6,
+        'июля': 7, 'августа': 8, 'сентября': 9, 'октября': 10, 'ноября': 11, 'декабря': 12
+    }
+    
+    METRICS = {
+        'просмотров': 'views',
+        'лайков': 'likes',
+        'комментариев': 'comments',
+        'жалоб': 'reports'
+    }
+    
+    _DATE = r'(\d{1,2}\s+(?:' + '|'.join(MONTHS) + r')\s+\d{4})(?:\s+года)?'
+    
+    TOTAL_VIDEOS = re.compile(r'^сколько\s+(?:всего\s+)?видео(?:\s+есть)?(?:\s+в\s+системе)?\s*\??$')
+    # "вышло с ... по ..." is about publication date (video_created_at), which
+    # QueryBuilder can't filter on, so only the undated form is handled here
+    CREATOR_VIDEOS = re.compile(r'^сколько\s+видео\s+(?:есть\s+)?у\s+креатора\s+с\s+id\s+(\d+)\s*\??$')
+    DAILY_SUM = re.compile(
+        r'^на\s+сколько\s+(' + '|'.join(METRICS) + r')\s+в\s+сумме\s+выросли\s+(?:все\s+)?видео\s+' + _DATE + r'\s*\??$'
+    )
+    
+    @classmethod
+    def _parse_date(cls, value: str) -> datetime:
+        day, month, year = value.split()[:3]
+        return datetime(int(year), cls.MONTHS[month], int(day))
+    
+    @classmethod
+    def _day_range(cls, start: str, end: str) -> Dict[str, str]:
+        """Whole-day range from the start of ``start`` to the end of ``end``, inclusive."""
+        end_date = cls._parse_date(end).replace(hour=23, minute=59, second=59, microsecond=999999)
+        return {'start': cls._parse_date(start).isoformat(), 'end': end_date.isoformat()}
+    
+    @classmethod
+    def parse(cls, question: str) -> Optional[QueryIntent]:
+        """Return the intent for a templated question, or None if no template matches."""
+        try:
+            return cls._match(' '.join(question.lower().split()))
+        except ValueError:
+            # Impossible date such as "31 февраля"; let the LLM deal with it
+            return None
+    
+    @classmethod
+    def _match(cls, question: str) -> Optional[QueryIntent]:
+        
+        if cls.TOTAL_VIDEOS.match(question):
+            return QueryIntent(intent='count', metric='videos')
+        
+        match = cls.CREATOR_VIDEOS.match(question)
+        if match:
+            return QueryIntent(intent='count', metric='videos', filters={'creator_id': int(match.group(1))})
+        
+        match = cls.DAILY_SUM.match(question)
+        if match:
+            metric, day = match.groups()
+            return QueryIntent(intent='sum', metric=cls.METRICS[metric], time_range=cls._day_range(day, day))
+        
+        return None
+
+class IntentCache:
+    """Two-tier cache of parsed intents: exact match first, then semantic similarity.
+
+    Entries are scoped by the current date, so relative questions ("вчера")
+    are never answered with an intent parsed on another day. The semantic tier
+    additionally requires both questions to share the same numbers and
+    meaning-bearing words (SCOPE_TERMS), otherwise "креатор с id 123" and
+    "креатор с id 124", or "просмотров в ноябре" and "лайков в декабре",
+    would collide.
+    """
+
+    def __init__(self, maxsize: int = 1024, path: Optional[str] = None,
+                 similarity_threshold: float = 0.95):
+        self.maxsize = maxsize
+        self.similarity_threshold = similarity_threshold
+        self._exact: "OrderedDict[str, dict]" = OrderedDict()
+        # Semantic tier: key -> (row in _vectors, scope, intent). Unit-length
+        # embeddings live in one matrix so a lookup is a single matmul.
+        self._semantic: "OrderedDict[str, Tuple[int, str, dict]]" = OrderedDict()
+        self._vectors: Optional[np.ndarray] = None
+        self._free_rows = list(range(maxsize))
+        
+        # Disk writes are queued by put() and written by flush() off the event loop
+        if path and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._store = shelve.open(path) if path else None
+        self._pending: List[Tuple[str, Any]] = []
+        self._pending_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        
+        # Warm up from disk so restarts don't cold-start. Entries are keyed by
+        # date, so those from previous days can never hit again; drop them
+        # instead of letting them evict today's entries.
+        if self._store is not None:
+            current_date = today()
+            for key in list(self._store.keys()):
+                tier, _, cache_key = key.partition(':')
+                if not cache_key.startswith(f"{current_date}|"):
+                    del self._store[key]
+                elif tier == 'exact':
+                    self._exact[cache_key] = self._store[key]
+                elif tier == 'semantic' and self._free_rows:
+                    vector, scope, data = self._store[key]
+                    self._add_semantic(cache_key, vector, scope, data)
+    
+    @staticmethod
+    def normalize(question: str) -> str:
+        """Lowercase the question and collapse whitespace."""
+        return ' '.join(question.lower().split())
+    
+    # Words that change the meaning of a question while barely moving its
+    # embedding: metrics, months, relative dates, comparisons, range direction,
+    # negation and the entity an id refers to. Questions are only compared
+    # semantically if they mention the same ones.
+    SCOPE_TERMS = [
+        (re.compile(pattern), term) for pattern, term in [
+            (r'просмотр', 'views'), (r'лайк', 'likes'), (r'коммент', 'comments'), (r'жалоб', 'reports'),
+            (r'январ', 'jan'), (r'феврал', 'feb'), (r'\bмарт', 'mar'), (r'апрел', 'apr'),
+            (r'\bма[йяе]\b', 'may'), (r'\bиюн', 'jun'), (r'\bиюл', 'jul'), (r'август', 'aug'),
+            (r'сентябр', 'sep'), (r'октябр', 'oct'), (r'ноябр', 'nov'), (r'декабр', 'dec'),
+            (r'позавчера', 'day_before_yesterday'), (r'(?<!поза)вчера', 'yesterday'),
+            (r'сегодня', 'today'), (r'недел', 'week'), (r'месяц', 'month'), (r'\bгод', 'year'),
+            (r'последн', 'last'), (r'прошл', 'previous'), (r'текущ|этот|эту|этом', 'current'),
+            (r'больше|более|выше|свыше', 'gt'), (r'меньше|менее|ниже', 'lt'),
+            (r'\bв\s+сумме|сумм', 'sum'), (r'средн', 'avg'), (r'разн', 'distinct'), (r'нов', 'new'),
+            (r'\bдо\b|раньше|ранее', 'before'), (r'после|позже|позднее', 'after'),
+            (r'\bс\b.*\bпо\b', 'between'), (r'\bне\b|\bни\b|\bнет\b|\bбез\b', 'not'),
+            (r'креатор|автор|канал', 'creator'), (r'видео\s+с\s+id|id\s+видео', 'video_id')
+        ]
+    ]
+    
+    @classmethod
+    def _scope(cls, question: str, current_date: str) -> str:
+        numbers = ','.join(re.findall(r'\d+', question))
+        terms = ','.join(sorted({term for pattern, term in cls.SCOPE_TERMS if pattern.search(question)}))
+        return f"{current_date}|{numbers}|{terms}"
+    
+    def get(self, question: str, current_date: str) -> Optional[QueryIntent]:
+        """Look up an intent cached for exactly this (normalized) question."""
+        key = f"{current_date}|{self.normalize(question)}"
+        if key in self._exact:
+            self._exact.move_to_end(key)
+            return QueryIntent(**self._exact[key])
+        return None
+    
+    def get_similar(self, question: str, current_date: str, vector: List[float]) -> Optional[QueryIntent]:
+        """Look up the most similar cached question by embedding, above the threshold."""
+        scope = self._scope(self.normalize(question), current_date)
+        candidates = [
+            (key, row, data) for key, (row, cached_scope, data) in self._semantic.items()
+            if cached_scope == scope
+        ]
+        if not candidates:
+            return None
+        
+        scores = self._vectors[[row for _, row, _ in candidates]] @ self._unit(vector)
+        best = int(np.argmax(scores))
+        if scores[best] > self.similarity_threshold:
+            key, _, data = candidates[best]
+            self._semantic.move_to_end(key)
+            return QueryIntent(**data)
+        return None
+    
+    def put(self, question: str, current_date: str, intent: QueryIntent,
+            vector: Optional[List[float]] = None):
+        """Store a parsed intent; it goes to the semantic tier too if an embedding is given."""
+        normalized = self.normalize(question)
+        key = f"{current_date}|{normalized}"
+        data = intent.model_dump()
+        
+        self._exact[key] = data
+        self._exact.move_to_end(key)
+        self._queue(f"exact:{key}", data)
+        while len(self._exact) > self.maxsize:
+            evicted, _ = self._exact.popitem(last=False)
+            self._queue(f"exact:{evicted}", None)
+        
+        if vector is not None:
+            scope = self._scope(normalized, current_date)
+            if key in self._semantic:
+                self._free_rows.append(self._semantic.pop(key)[0])
+            elif not self._free_rows:
+                evicted, (row, _, _) = self._semantic.popitem(last=False)
+                self._free_rows.append(row)
+                self._queue(f"semantic:{evicted}", None)
+            self._add_semantic(key, vector, scope, data)
+            self._queue(f"semantic:{key}", (list(vector), scope, data))
+    
+    @staticmethod
+    def _unit(vector: List[float]) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+    
+    def _add_semantic(self, key: str, vector: List[float], scope: str, data: dict):
+        if self._vectors is None:
+            self._vectors = np.zeros((self.maxsize, len(vector)), dtype=np.float32)
+        row = self._free_rows.pop()
+        self._vectors[row] = self._unit(vector)
+        self._semantic[key] = (row, scope, data)
+    
+    def _queue(self, store_key: str, value):
+        """Queue a write (or a delete, if value is None) for the next flush()."""
+        if self._store is not None:
+            with self._pending_lock:
+                self._pending.append((store_key, value))
+    
+    def flush(self):
+        """Write queued changes to disk. Blocking; run it in an executor."""
+        if self._store is None:
+            return
+        with self._flush_lock:
+            with self._pending_lock:
+                pending, self._pending = self._pending, []
+            try:
+                while pending:
+                    store_key, value = pending[0]
+                    if value is None:
+                        self._store.pop(store_key, None)
+                    else:
+                        try:
+                            self._store[store_key] = value
+                        except (pickle.PicklingError, TypeError, AttributeError) as e:
+                            # Retrying can't help; don't let it block the rest of the queue
+                            logger.error(f"Skipping unpicklable cache entry {store_key}: {e}")
+                    pending.pop(0)
+                self._store.sync()
+            finally:
+                # Keep whatever wasn't written for the next flush
+                if pending:
+                    with self._pending_lock:
+                        self._pending[:0] = pending
+    
+    def close(self):
+        if self._store is not None:
+            self.flush()
+            self._store.close()
+
+SYSTEM_PROMPT = """
+You are a helpful assistant that translates natural language questions about video analytics into structured queries.
+The database has the following tables:
+
+Table: videos
+- id: integer (primary key)
+- creator_id: integer
+- video_created_at: datetime
+- views_count: integer
+- likes_count: integer
+- comments_count: integer
+- reports_count: integer
+- created_at: datetime
+- updated_at: datetime
+
+Table: video_snapshots
+- id: integer (primary key)
+- video_id: integer (foreign key to videos.id)
+- views_count: integer
+- likes_count: integer
+- comments_count: integer
+- reports_count: integer
+- delta_views_count: integer
+- delta_likes_count: integer
+- delta_comments_count: integer
+- delta_reports_count: integer
+- created_at: datetime
+- updated_at: datetime
+
+When analyzing a question:
+1. Determine if it's asking about videos or snapshots
+2. Identify the metric being queried (views, likes, comments, reports)
+3. Extract any time ranges or filters
+4. Determine if it's a count, sum, or other aggregation
+5. Identify any grouping
+
+Example questions and their interpretations:
+- "Сколько всего видео есть в системе?" -> count all videos
+- "Сколько видео у креатора с id 123 вышло с 1 ноября 2025 по 5 ноября 2025 включительно?" -> count videos by creator_id=123 between dates
+- "Сколько видео набрало больше 100000 просмотров за всё время?" -> count videos where views_count > 100000
+- "На сколько просмотров в сумме выросли все видео 28 ноября 2025?" -> sum of delta_views_count for snapshots on that date
+- "Сколько разных видео получали новые просмотры 27 ноября 2025?" -> count distinct video_ids from snapshots where created_at is that date and delta_views_count > 0
+
+Current date: {current_date}
+"""
+
+# The LLM returns the intent as arguments of this function, so no format
+# instructions are needed in the prompt and the output is always JSON
+BUILD_INTENT_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "build_intent",
+        "description": "Build a structured query from a question about video analytics.",
+        "parameters": QueryIntent.model_json_schema()
+    }
+}
+
 class NLPService:
-    def __init__(self, openai_api_key: str):
-        self.llm = ChatOpenAI(
-            temperature=0,
-            model_name="gpt-3.5-turbo",
-            openai_api_key=openai_api_key
+    def __init__(self, openai_api_key: str, cache_path: Optional[str] = None,
+                 semantic_cache: bool = False):
+        # One long-lived HTTP/2 client so every call reuses a warm TLS connection
+        self.http_client = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=20)
         )
+        self.client = AsyncOpenAI(api_key=openai_api_key, http_client=self.http_client)
+        self.model = "gpt-3.5-turbo"
+        self.embedding_model = "text-embedding-3-small"
         
-        self.parser = PydanticOutputParser(pydantic_object=QueryIntent)
-        
-        self.prompt = ChatPromptTemplate.from_messages([
-            ("system", """
-            You are a helpful assistant that translates natural language questions about video analytics into structured queries.
-            The database has the following tables:
-            
-            Table: videos
-            - id: integer (primary key)
-            - creator_id: integer
-            - video_created_at: datetime
-            - views_count: integer
-            - likes_count: integer
-            - comments_count: integer
-            - reports_count: integer
-            - created_at: datetime
-            - updated_at: datetime
-            
-            Table: video_snapshots
-            - id: integer (primary key)
-            - video_id: integer (foreign key to videos.id)
-            - views_count: integer
-            - likes_count: integer
-            - comments_count: integer
-            - reports_count: integer
-            - delta_views_count: integer
-            - delta_likes_count: integer
-            - delta_comments_count: integer
-            - delta_reports_count: integer
-            - created_at: datetime
-            - updated_at: datetime
-            
-            When analyzing a question:
-            1. Determine if it's asking about videos or snapshots
-            2. Identify the metric being queried (views, likes, comments, reports)
-            3. Extract any time ranges or filters
-            4. Determine if it's a count, sum, or other aggregation
-            5. Identify any grouping
-            
-            Example questions and their interpretations:
-            - "Сколько всего видео есть в системе?" -> count all videos
-            - "Сколько видео у креатора с id 123 вышло с 1 ноября 2025 по 5 ноября 2025 включительно?" -> count videos by creator_id=123 between dates
-            - "Сколько видео набрало больше 100000 просмотров за всё время?" -> count videos where views_count > 100000
-            - "На сколько просмотров в сумме выросли все видео 28 ноября 2025?" -> sum of delta_views_count for snapshots on that date
-            - "Сколько разных видео получали новые просмотры 27 ноября 2025?" -> count distinct video_ids from snapshots where created_at is that date and delta_views_count > 0
-            
-            Current date: {current_date}
-            
-            {format_instructions}
-            
-            Question: {question}
-            """),
-            ("human", "{question}")
-        ])
-        
-        self.chain = LLMChain(
-            llm=self.llm,
-            prompt=self.prompt,
-            output_parser=self.parser
+        # Repeated questions are answered from the cache without calling the LLM
+        self.semantic_cache = semantic_cache
+        self.cache = IntentCache(path=cache_path)
+        self._flush_tasks = set()
+    
+    def _schedule_flush(self):
+        """Persist queued cache writes in the background, off the reply path."""
+        task = asyncio.create_task(self._flush_cache())
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+    
+    async def _flush_cache(self):
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self.cache.flush)
+        except Exception as e:
+            # Writes stay queued and are retried by the next flush
+            logger.error(f"Failed to persist intent cache: {e}", exc_info=True)
+    
+    async def close(self):
+        """Close the HTTP client and the intent cache."""
+        await asyncio.gather(*self._flush_tasks)
+        await self.http_client.aclose()
+        self.cache.close()
+    
+    async def _embed(self, question: str) -> List[float]:
+        response = await self.client.embeddings.create(
+            model=self.embedding_model,
+            input=IntentCache.normalize(question)
         )
+        return response.data[0].embedding
     
-    def parse_query(self, question: str) -> QueryIntent:
+    async def _call_llm(self, question: str, current_date: str) -> QueryIntent:
+        response = await self.client.chat.completions.create(
+            model=self.model,
+            temperature=0,
+            messages=[
+                {"role": "system", "content": SYSTEM_PROMPT.format(current_date=current_date)},
+                {"role": "user", "content": question}
+            ],
+            tools=[BUILD_INTENT_TOOL],
+            tool_choice={"type": "function", "function": {"name": "build_intent"}}
+        )
+        tool_call = response.choices[0].message.tool_calls[0]
+        return QueryIntent.model_validate_json(tool_call.function.arguments)
+    
+    async def parse_query(self, question: str) -> QueryIntent:
         """Parse a natural language question into a structured query."""
+        # Templated questions don't need the LLM at all
+        intent = FastIntentParser.parse(question)
+        if intent is not None:
+            return intent
+        
         try:
-            response = self.chain.run(
-                question=question,
-                current_date=datetime.now().strftime("%Y-%m-%d"),
-                format_instructions=self.parser.get_format_instructions()
-            )
-            return response
+            current_date = today()
+            intent = self.cache.get(question, current_date)
+            if intent is not None:
+                return intent
+            
+            vector = None
+            if self.semantic_cache:
+                vector = await self._embed(question)
+                intent = self.cache.get_similar(question, current_date, vector)
+                if intent is not None:
+                    return intent
+            
+            intent = await self._call_llm(question, current_date)
+            self.cache.put(question, current_date, intent, vector)
+            self._schedule_flush()
+            return intent
         except Exception as e:
             print(f"Error parsing query: {e}")
             raise ValueError("Не удалось обработать ваш запрос. Пожалуйста, сформулируйте его иначе.")
@@ -100,6 +424,17 @@ class NLPService:
 class QueryBuilder:
     """Builds SQL queries from structured query intents."""
     
+    # Columns the LLM may filter on, per table, with the type to coerce values to.
+    # Filter keys end up in the SQL text, so anything else is rejected.
+    ALLOWED_FILTERS = {
+        'videos': {'id': int, 'creator_id': int},
+        'video_snapshots': {'id': int, 'video_id': int},
+        'snapshot_daily': {'video_id': int}
+    }
+    
+    # UTC time the last snapshot_daily refresh started; set by the bot
+    daily_view_refreshed_at: Optional[datetime] = None
+    
     @staticmethod
     def build_query(intent: QueryIntent) -> tuple[str, dict]:
         """Build a SQL query from a query intent."""
@@ -111,6 +446,68 @@ class QueryBuilder:
         else:
             raise ValueError(f"Unsupported query type: {intent.intent}")
     
+    @staticmethod
+    @lru_cache(maxsize=128)
+    def compile(query: str) -> TextClause:
+        """Return a TextClause for the query, reusing it for identical SQL.
+
+        There are only a handful of query shapes, so the same TextClause
+        object is handed to SQLAlchemy and its compiled cache is hit.
+        """
+        return text(query)
+    
+    @staticmethod
+    def _parse_datetime(value: str) -> datetime:
+        """Convert a time range bound to a datetime; asyncpg doesn't accept strings for timestamps."""
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        # Columns are timestamp without time zone and hold UTC
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+    
+    @staticmethod
+    def _can_use_daily_view(intent: QueryIntent) -> bool:
+        """Whether snapshot_daily can answer a sum for this intent exactly.
+
+        The range must start and end on day boundaries, filters must exist in
+        the view, and the range must have ended before the last refresh:
+        days still receiving snapshots (today included) are summed from
+        video_snapshots so they are never stale.
+        """
+        refreshed_at = QueryBuilder.daily_view_refreshed_at
+        time_range = intent.time_range or {}
+        if refreshed_at is None or 'end' not in time_range:
+            return False
+        if not set(intent.filters) <= set(QueryBuilder.ALLOWED_FILTERS['snapshot_daily']):
+            return False
+        if 'start' in time_range:
+            start = QueryBuilder._parse_datetime(time_range['start'])
+            if start != start.replace(hour=0, minute=0, second=0, microsecond=0):
+                return False
+        end = QueryBuilder._parse_datetime(time_range['end'])
+        if (end.hour, end.minute, end.second) != (23, 59, 59):
+            return False
+        return end < refreshed_at
+    
+    @staticmethod
+    def _build_filters(intent: QueryIntent, table: str, params: dict) -> list[str]:
+        """Validate equality filters against the whitelist and add them to params.
+
+        Keys are sorted so the same set of filters always yields the same SQL
+        text, which keeps the statement caches warm.
+        """
+        allowed = QueryBuilder.ALLOWED_FILTERS[table]
+        where_clauses = []
+        for key in sorted(intent.filters):
+            if key not in allowed:
+                raise ValueError(f"Unsupported filter for {table}: {key}")
+            try:
+                params[key] = allowed[key](intent.filters[key])
+            except (TypeError, ValueError):
+                raise ValueError(f"Invalid value for filter {key}: {intent.filters[key]!r}")
+            where_clauses.append(f"{key} = :{key}")
+        return where_clauses
+    
     @staticmethod
     def _build_count_query(intent: QueryIntent) -> tuple[str, dict]:
         """Build a count query."""
@@ -121,20 +518,22 @@ class QueryBuilder:
         if intent.time_range:
             if 'start' in intent.time_range:
                 where_clauses.append("created_at >= :start_date")
-                params['start_date'] = intent.time_range['start']
+                params['start_date'] = QueryBuilder._parse_datetime(intent.time_range['start'])
             if 'end' in intent.time_range:
                 where_clauses.append("created_at <= :end_date")
-                params['end_date'] = intent.time_range['end']
+                params['end_date'] = QueryBuilder._parse_datetime(intent.time_range['end'])
         
         # Handle filters
-        for key, value in intent.filters.items():
-            where_clauses.append(f"{key} = :{key}")
-            params[key] = value
+        table = 'videos' if intent.metric == 'videos' else 'video_snapshots'
+        where_clauses.extend(QueryBuilder._build_filters(intent, table, params))
         
         # Build the query
         where_clause = f"WHERE {' AND '.join(where_clauses)}" if where_clauses else ""
         
-        if intent.metric == 'videos':
+        if table == 'videos' and not where_clauses:
+            # Unfiltered total is maintained by triggers in the stats table
+            query = "SELECT value FROM stats WHERE name = 'videos_total'"
+        elif table == 'videos':
             query = f"SELECT COUNT(*) FROM videos {where_clause}"
         else:
             # For other metrics, we're likely querying snapshots
@@ -148,19 +547,23 @@ class QueryBuilder:
         params = {}
         where_clauses = []
         
+        # Completed whole-day ranges are answered from the pre-aggregated daily view
+        if QueryBuilder._can_use_daily_view(intent):
+            table, time_column = 'snapshot_daily', 'day'
+        else:
+            table, time_column = 'video_snapshots', 'created_at'
+        
         # Handle time range
         if intent.time_range:
             if 'start' in intent.time_range:
-                where_clauses.append("created_at >= :start_date")
-                params['start_date'] = intent.time_range['start']
+                where_clauses.append(f"{time_column} >= :start_date")
+                params['start_date'] = QueryBuilder._parse_datetime(intent.time_range['start'])
             if 'end' in intent.time_range:
-                where_clauses.append("created_at <= :end_date")
-                params['end_date'] = intent.time_range['end']
+                where_clauses.append(f"{time_column} <= :end_date")
+                params['end_date'] = QueryBuilder._parse_datetime(intent.time_range['end'])
         
         # Handle filters
-        for key, value in intent.filters.items():
-            where_clauses.append(f"{key} = :{key}")
-            params[key] = value
+        where_clauses.extend(QueryBuilder._build_filters(intent, table, params))
         
         # Determine the column to sum based on the metric
         metric_column = {
@@ -172,6 +575,6 @@ class QueryBuilder:
         
         # Build the query
         where_clause = f"WHERE {' AND '.join(where_clauses)}" if where_clauses else ""
-        query = f"SELECT COALESCE(SUM({metric_column}), 0) FROM video_snapshots {where_clause}"
+        query = f"SELECT COALESCE(SUM({metric_column}), 0) FROM {table} {where_clause}"
         
         return query, params
@@ -1,97 +1,206 @@
-import json
+import io
 import os
-from datetime import datetime
-from sqlalchemy.orm import Session
+import ijson
+import orjson
+import pandas as pd
 from sqlalchemy import text
-from app.database import SessionLocal, engine
-from app.models import Base, Video, VideoSnapshot
+from app.database import engine, init_db
+from app.models import Base
 from dotenv import load_dotenv
 
-def parse_datetime(dt_str):
-    # Handle different datetime formats
-    try:
-        return datetime.strptime(dt_str, '%Y-%m-%dT%H:%M:%S.%fZ')
-    except ValueError:
-        try:
-            return datetime.strptime(dt_str, '%Y-%m-%dT%H:%M:%SZ')
-        except ValueError:
-            return datetime.strptime(dt_str, '%Y-%m-%d %H:%M:%S')
+# Rows are streamed to PostgreSQL with COPY in chunks of this size
+CHUNK_SIZE = 10_000
+
+VIDEO_COLUMNS = [
+    'id', 'creator_id', 'video_created_at', 'views_count', 'likes_count',
+    'comments_count', 'reports_count', 'created_at', 'updated_at'
+]
+
+SNAPSHOT_COLUMNS = [
+    'id', 'video_id', 'views_count', 'likes_count', 'comments_count', 'reports_count',
+    'delta_views_count', 'delta_likes_count', 'delta_comments_count', 'delta_reports_count',
+    'created_at', 'updated_at'
+]
+
+# Timestamp columns are parsed per chunk in one vectorized call
+VIDEO_DATETIME_COLUMNS = ['video_created_at', 'created_at', 'updated_at']
+SNAPSHOT_DATETIME_COLUMNS = ['created_at', 'updated_at']
+
+# Files larger than this are streamed with ijson instead of being read whole
+STREAMING_THRESHOLD = 64 * 1024 * 1024
+
+# Delta columns and the counters they are computed from when missing in the dump
+DELTA_COLUMNS = {
+    'delta_views_count': 'views_count',
+    'delta_likes_count': 'likes_count',
+    'delta_comments_count': 'comments_count',
+    'delta_reports_count': 'reports_count'
+}
+
+# Default name PostgreSQL gives to the video_snapshots.video_id foreign key
+SNAPSHOT_FK_NAME = 'video_snapshots_video_id_fkey'
 
 def load_json_data(file_path):
-    with open(file_path, 'r', encoding='utf-8') as f:
-        return json.load(f)
-
-def insert_video(db: Session, video_data):
-    # Insert video
-    video = Video(
-        id=video_data['id'],
-        creator_id=video_data['creator_id'],
-        video_created_at=parse_datetime(video_data['video_created_at']),
-        views_count=video_data['views_count'],
-        likes_count=video_data.get('likes_count', 0),
-        comments_count=video_data.get('comments_count', 0),
-        reports_count=video_data.get('reports_count', 0),
-        created_at=parse_datetime(video_data['created_at']),
-        updated_at=parse_datetime(video_data['updated_at'])
-    )
-    db.add(video)
+    """Yield video dicts from either a top-level list or a {"videos": [...]} object.
+
+    Small files are decoded in one go with orjson; large ones are streamed
+    with ijson so memory stays proportional to a single video.
+    """
+    if os.path.getsize(file_path) < STREAMING_THRESHOLD:
+        with open(file_path, 'rb') as f:
+            data = orjson.loads(f.read())
+        yield from data['videos'] if isinstance(data, dict) else data
+        return
     
-    # Insert snapshots
-    for snapshot_data in video_data.get('snapshots', []):
-        snapshot = VideoSnapshot(
-            id=snapshot_data['id'],
-            video_id=video.id,
-            views_count=snapshot_data['views_count'],
-            likes_count=snapshot_data.get('likes_count', 0),
-            comments_count=snapshot_data.get('comments_count', 0),
-            reports_count=snapshot_data.get('reports_count', 0),
-            delta_views_count=snapshot_data.get('delta_views_count', 0),
-            delta_likes_count=snapshot_data.get('delta_likes_count', 0),
-            delta_comments_count=snapshot_data.get('delta_comments_count', 0),
-            delta_reports_count=snapshot_data.get('delta_reports_count', 0),
-            created_at=parse_datetime(snapshot_data['created_at']),
-            updated_at=parse_datetime(snapshot_data['updated_at'])
-        )
-        db.add(snapshot)
+    with open(file_path, 'rb') as f:
+        # Peek at the first token to pick the prefix of the video array
+        head = f.read(1024).lstrip()
+        f.seek(0)
+        prefix = 'videos.item' if head.startswith(b'{') else 'item'
+        yield from ijson.items(f, prefix, use_float=True)
+
+def video_row(video_data):
+    return [
+        video_data['id'],
+        video_data['creator_id'],
+        video_data['video_created_at'],
+        video_data['views_count'],
+        video_data.get('likes_count', 0),
+        video_data.get('comments_count', 0),
+        video_data.get('reports_count', 0),
+        video_data['created_at'],
+        video_data['updated_at']
+    ]
+
+def snapshot_rows(video_data):
+    return [
+        [
+            snapshot_data['id'],
+            video_data['id'],
+            snapshot_data['views_count'],
+            snapshot_data.get('likes_count', 0),
+            snapshot_data.get('comments_count', 0),
+            snapshot_data.get('reports_count', 0),
+            snapshot_data.get('delta_views_count'),
+            snapshot_data.get('delta_likes_count'),
+            snapshot_data.get('delta_comments_count'),
+            snapshot_data.get('delta_reports_count'),
+            snapshot_data['created_at'],
+            snapshot_data['updated_at']
+        ]
+        for snapshot_data in video_data.get('snapshots', [])
+    ]
+
+def parse_datetimes(df, columns):
+    """Parse timestamp columns in place, as naive UTC datetimes.
+
+    pandas parses every ISO 8601 variant found in the dump (with or without
+    fractional seconds, "Z" or "+00:00" suffix, space separator) in C.
+    """
+    for column in columns:
+        df[column] = pd.to_datetime(df[column], utc=True, format='ISO8601').dt.tz_convert(None)
+
+def fill_deltas(df):
+    """Compute missing delta_* values from consecutive snapshots of each video.
+
+    A whole video's snapshots always land in the same chunk, so a vectorized
+    groupby().diff() over the chunk sees every snapshot of a video. As in the
+    dump, the first snapshot's delta is the counter itself (growth from zero).
+    """
+    missing = {delta_column: df[delta_column].isna() for delta_column in DELTA_COLUMNS}
     
-    return video
+    # Only sort when something has to be computed; complete dumps skip it
+    if any(mask.any() for mask in missing.values()):
+        ordered = df.sort_values(['video_id', 'created_at'])
+        for delta_column, column in DELTA_COLUMNS.items():
+            if missing[delta_column].any():
+                computed = ordered.groupby('video_id')[column].diff().fillna(ordered[column])
+                df.loc[missing[delta_column], delta_column] = computed[missing[delta_column]]
+    
+    for delta_column in DELTA_COLUMNS:
+        df[delta_column] = df[delta_column].astype('int64')
+
+def copy_rows(cursor, table, columns, rows, datetime_columns, prepare=None):
+    """Send rows to PostgreSQL in a single COPY ... FROM STDIN round-trip."""
+    if not rows:
+        return
+    df = pd.DataFrame(rows, columns=columns)
+    parse_datetimes(df, datetime_columns)
+    if prepare is not None:
+        prepare(df)
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH CSV", buffer)
+
+def drop_constraints(conn):
+    """Drop indexes and the snapshot foreign key so they aren't maintained row by row."""
+    conn.execute(text(f"ALTER TABLE video_snapshots DROP CONSTRAINT IF EXISTS {SNAPSHOT_FK_NAME}"))
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.drop(bind=conn, checkfirst=True)
+
+def create_constraints(conn):
+    """Rebuild indexes and the snapshot foreign key in one pass after the load."""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=conn, checkfirst=True)
+    conn.execute(text(
+        f"ALTER TABLE video_snapshots ADD CONSTRAINT {SNAPSHOT_FK_NAME} "
+        "FOREIGN KEY (video_id) REFERENCES videos (id)"
+    ))
 
 def main():
     # Load environment variables
     load_dotenv()
     
-    # Create tables if they don't exist
-    Base.metadata.create_all(bind=engine)
-    
-    db = SessionLocal()
+    # Create tables and counter triggers if they don't exist
+    init_db()
     
     try:
-        # Clear existing data
-        print("Clearing existing data...")
-        db.execute(text("TRUNCATE TABLE video_snapshots CASCADE"))
-        db.execute(text("TRUNCATE TABLE videos CASCADE"))
-        db.commit()
-        
-        # Load and insert data
-        print("Loading data from videos.json...")
-        data = load_json_data('videos.json')
-        total = len(data)
-        
-        print(f"Inserting {total} videos...")
-        for i, video_data in enumerate(data, 1):
-            insert_video(db, video_data)
-            if i % 100 == 0:
-                print(f"Processed {i}/{total} videos...")
-                db.commit()
+        # Everything runs in a single transaction and is committed once at the end
+        with engine.begin() as conn:
+            cursor = conn.connection.cursor()
+            
+            # Clear existing data
+            print("Clearing existing data...")
+            conn.execute(text("TRUNCATE TABLE video_snapshots, videos CASCADE"))
+            drop_constraints(conn)
+            
+            # Load and insert data
+            print("Loading data from videos.json...")
+            data = load_json_data('videos.json')
+            
+            print("Inserting videos...")
+            videos, snapshots = [], []
+            for i, video_data in enumerate(data, 1):
+                videos.append(video_row(video_data))
+                snapshots.extend(snapshot_rows(video_data))
+                if len(videos) >= CHUNK_SIZE or len(snapshots) >= CHUNK_SIZE:
+                    copy_rows(cursor, 'videos', VIDEO_COLUMNS, videos, VIDEO_DATETIME_COLUMNS)
+                    copy_rows(cursor, 'video_snapshots', SNAPSHOT_COLUMNS, snapshots, SNAPSHOT_DATETIME_COLUMNS, fill_deltas)
+                    videos, snapshots = [], []
+                    print(f"Processed {i} videos...")
+            
+            copy_rows(cursor, 'videos', VIDEO_COLUMNS, videos, VIDEO_DATETIME_COLUMNS)
+            copy_rows(cursor, 'video_snapshots', SNAPSHOT_COLUMNS, snapshots, SNAPSHOT_DATETIME_COLUMNS, fill_deltas)
+            
+            print("Rebuilding indexes...")
+            create_constraints(conn)
+            
+            # Rebuild daily aggregates; nothing reads the view during the load
+            print("Refreshing daily aggregates...")
+            conn.execute(text("REFRESH MATERIALIZED VIEW snapshot_daily"))
+            
+            # Refresh planner statistics for the new data
+            conn.execute(text("ANALYZE videos"))
+            conn.execute(text("ANALYZE video_snapshots"))
+            conn.execute(text("ANALYZE snapshot_daily"))
         
-        db.commit()
         print("Data loading completed successfully!")
         
     except Exception as e:
         print(f"Error: {e}")
-        db.rollback()
-    finally:
-        db.close()
 
 if __name__ == "__main__":
     main()